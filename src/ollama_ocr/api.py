@@ -1,11 +1,14 @@
 import os
 import json
+from functools import wraps
 from dotenv import load_dotenv
 
 from bottle import Bottle, run, request, response, abort
 from ocr_processor import OCRProcessor
 from typing import Dict, Any, List, Union
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 load_dotenv(".env")
 
@@ -13,28 +16,85 @@ load_dotenv(".env")
 BASE_URL = os.getenv("OLLAMA_BASE_URL")
 API_KEY = os.getenv("API_KEY")
 FIRECRAWL_KEY = os.getenv("FIRECRAWL_KEY")
+CORS_ORIGIN = os.getenv("CORS_ORIGIN")
 
-valid_tokens = []
 raw_valid_tokens = os.getenv("VALID_TOKENS")
 try:
-    valid_tokens = json.loads(raw_valid_tokens)
+    valid_tokens = json.loads(raw_valid_tokens or "[]")
 except json.JSONDecodeError:
     valid_tokens = []
+if not isinstance(valid_tokens, list):
+    valid_tokens = []
+# 只保留字符串 Token，避免配置中的非字符串项导致启动失败
+VALID_TOKENS = frozenset(t for t in valid_tokens if isinstance(t, str))
+# 合法 Token 的长度范围，用于快速拒绝格式明显不对的 Token
+MIN_TOKEN_LEN = min(map(len, VALID_TOKENS), default=0)
+MAX_TOKEN_LEN = max(map(len, VALID_TOKENS), default=0)
+
+# Firecrawl 复用连接的 Session
+firecrawl_session = requests.Session()
+firecrawl_session.mount(
+    "https://",
+    HTTPAdapter(
+        pool_connections=10,
+        pool_maxsize=50,
+        max_retries=Retry(
+            total=3,
+            read=0,
+            backoff_factor=0.3,
+            # 只重试明确表示请求未被处理的状态码，避免重复执行 POST
+            status_forcelist=[429, 503],
+            allowed_methods=None,
+        ),
+    ),
+)
+firecrawl_session.headers.update(
+    {
+        "Authorization": f"Bearer {FIRECRAWL_KEY}",
+        "Content-Type": "application/json",
+    }
+)
+
+# 所有请求共用一个 OCRProcessor
+OCR_PROCESSOR = OCRProcessor(
+    model_name="llama3.2-vision:11b",
+    base_url=BASE_URL,
+    api_key=API_KEY,
+    max_workers=4,
+    preprocess_cache_size=0,  # 不在请求之间缓存上传的文档
+)
 
 app = Bottle()
 
+
+@app.hook("after_request")
+def enable_cors():
+    # 仅在配置了 CORS_ORIGIN 时返回跨域响应头
+    if CORS_ORIGIN:
+        response.headers["Access-Control-Allow-Origin"] = CORS_ORIGIN
+        response.headers["Access-Control-Allow-Methods"] = "GET, POST, OPTIONS"
+        response.headers["Access-Control-Allow-Headers"] = "Authorization, Content-Type"
+
+
 # Token 验证装饰器
 
 
 def token_required(func):
+    @wraps(func)
     def wrapper(*args, **kwargs):
+        # CORS 预检请求不携带 Token，直接返回
+        if request.method == "OPTIONS":
+            return ""
+
         # 从请求头获取 Token
         auth_header = request.headers.get("Authorization")
         if not auth_header or not auth_header.startswith("Bearer "):
             abort(401, "Unauthorized: Missing or invalid Token")
 
-        token = auth_header.split(" ")[1]
-        if token not in valid_tokens:
+        token = auth_header.split(" ", 1)[1]
+        if not MIN_TOKEN_LEN <= len(token) <= MAX_TOKEN_LEN:
+            abort(401, "Unauthorized: Invalid Token")
+        if token not in VALID_TOKENS:
             abort(401, "Unauthorized: Invalid Token")
 
         # Token 验证通过，执行原函数
@@ -43,13 +103,19 @@ def token_required(func):
     return wrapper
 
 
-@app.route("/api/extract", method=["POST"])
+@app.route("/api/extract", method=["POST", "OPTIONS"])
 @token_required
 def extract():
     """
     Extract text from an image using OCR.
     """
-    body = request.json
+    try:
+        body = request.json or {}
+    except ValueError:
+        return {"error": "invalid json body"}
+    if not isinstance(body, dict):
+        return {"error": "invalid json body"}
+
     urls = body.get("urls")
 
     if urls is None:
@@ -64,20 +130,14 @@ def extract():
 
     format_type = body.get("format_type", "markdown")
     prompt = body.get("prompt", None)
-
-    ocr_processor = OCRProcessor(
-        model_name="llama3.2-vision:11b",
-        base_url=BASE_URL,
-        api_key=API_KEY,
-        max_workers=4,
-    )
+    preprocess = bool(body.get("preprocess", False))
 
     try:
-        results = ocr_processor.process_batch(
+        results = OCR_PROCESSOR.process_batch(
             input_path=urls,
             format_type=format_type,
             custom_prompt=prompt,
-            preprocess=True,
+            preprocess=preprocess,
             language="en",
         )
         return results
@@ -85,7 +145,7 @@ def extract():
         return {"error": str(e)}
 
 
-@app.route("/api/fetch_asin", method=["GET"])
+@app.route("/api/fetch_asin", method=["GET", "OPTIONS"])
 @token_required
 def fetch_asin():
     """
@@ -104,17 +164,11 @@ def fetch_asin():
         },
     }
 
-    headers = {
-        "Authorization": f"Bearer {FIRECRAWL_KEY}",
-        "Content-Type": "application/json",
-    }
-
     print(f"Requesting Firecrawl API for: {asin}")
     try:
-        resp = requests.post(
+        resp = firecrawl_session.post(
             "https://api.firecrawl.dev/v1/scrape",
             json=payloads,
-            headers=headers,
             timeout=60,
         )
         resp.raise_for_status()
@@ -3,130 +3,378 @@ from typing import Dict, Any, List, Union
 import os
 import base64
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from tqdm import tqdm
 import concurrent.futures
 from pathlib import Path
 import cv2
 import pymupdf 
 import numpy as np
+from PIL import Image
 import tempfile
+import shutil
 import mimetypes
 import urllib.parse
+import functools
+import threading
+import time
+import hashlib
+import logging
+import re
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# File extensions picked up when a directory is passed to process_batch
+_BATCH_EXTENSIONS = frozenset({'.png', '.jpg', '.jpeg', '.pdf', '.tiff'})
+
+# Default prompts per format type; {language} is filled in by _get_prompt
+_PROMPT_TEMPLATES = {
+    "markdown": """Extract all text content from this image in {language} **exactly as it appears**, without modification, summarization, or omission.
+                                Format the output in markdown:
+                                - Use headers (#, ##, ###) **only if they appear in the image**
+                                - Preserve original lists (-, *, numbered lists) as they are
+                                - Maintain all text formatting (bold, italics, underlines) exactly as seen
+                                - **Do not add, interpret, or restructure any content**
+                            """,
+    "text": """Extract all visible text from this image in {language} **without any changes**.
+                                - **Do not summarize, paraphrase, or infer missing text.**
+                                - Retain all spacing, punctuation, and formatting exactly as in the image.
+                                - If text is unclear or partially visible, extract as much as possible without guessing.
+                                - **Include all text, even if it seems irrelevant or repeated.** 
+                                """,
+    "json": """Extract all text from this image in {language} and format it as JSON, **strictly preserving** the structure.
+                                - **Do not summarize, add, or modify any text.**
+                                - Maintain hierarchical sections and subsections as they appear.
+                                - Use keys that reflect the document's actual structure (e.g., "title", "body", "footer").
+                                - Include all text, even if fragmented, blurry, or unclear.
+                                """,
+    "structured": """Extract all text from this image in {language}, **ensuring complete structural accuracy**:
+                                - Identify and format tables **without altering content**.
+                                - Preserve list structures (bulleted, numbered) **exactly as shown**.
+                                - Maintain all section headings, indents, and alignments.
+                                - **Do not add, infer, or restructure the content in any way.**
+                                """,
+    "key_value": """Extract all key-value pairs from this image in {language} **exactly as they appear**:
+                                - Identify and extract labels and their corresponding values without modification.
+                                - Maintain the exact wording, punctuation, and order.
+                                - Format each pair as 'key: value' **only if clearly structured that way in the image**.
+                                - **Do not infer missing values or add any extra text.**
+                                """,
+    "table": """Extract all tabular data from this image in {language} **exactly as it appears**, without modification, summarization, or omission.
+                                - **Preserve the table structure** (rows, columns, headers) as closely as possible.
+                                - **Do not add missing values or infer content**—if a cell is empty, leave it empty.
+                                - Maintain all numerical, textual, and special character formatting.
+                                - If the table contains merged cells, indicate them clearly without altering their meaning.
+                                - Output the table in a structured format such as Markdown, CSV, or JSON, based on the intended use.
+                                """,
+}
+
+# Appended to the prompt when several PDF pages are sent in one request
+_BATCH_PROMPT_SUFFIX = """
+You are given {count} images, one per page. For each image k from 1 to {count}, in order,
+output a line '===PAGE k===' followed by the text extracted from that image."""
+
+# Matches the page delimiter lines requested by _BATCH_PROMPT_SUFFIX
+_PAGE_DELIMITER_RE = re.compile(r"^[ \t]*===PAGE (\d+)===[ \t]*$", re.MULTILINE)
+
+
+@functools.lru_cache(maxsize=32)
+def _get_prompt(format_type: str, language: str) -> str:
+    """Return the default prompt for format_type (falls back to "text") in the given language"""
+    template = _PROMPT_TEMPLATES.get(format_type, _PROMPT_TEMPLATES["text"])
+    return template.format(language=language)
+
 
 class OCRProcessor:
     def __init__(self, model_name: str = "llama3.2-vision:11b", 
                  base_url: str = "http://localhost:11434/api/generate",
                  api_key: str = None,
-                 max_workers: int = 1):
+                 max_workers: int = 1,
+                 denoise_strength: str = "normal",
+                 max_image_side: int = 1568,
+                 requests_per_second: float = None,
+                 preprocess_cache_size: int = 0):
         
         self.model_name = model_name
         self.base_url = base_url
         self.max_workers = max_workers
+        # "normal" uses a fast edge-preserving filter, "high" uses non-local means
+        self.denoise_strength = denoise_strength
+        # Longest side sent to the vision model; larger images are downscaled (None disables)
+        self.max_image_side = max_image_side
+
+        # Bound in-flight Ollama calls across batch- and page-level parallelism
+        self._request_sem = threading.BoundedSemaphore(max(1, self.max_workers))
+        # Optional spacing between Ollama calls (None disables)
+        self.requests_per_second = requests_per_second
+        self._rate_lock = threading.Lock()
+        self._next_request_at = 0.0
+
+        # CLAHE objects keep internal state, so each worker thread gets its own
+        self._thread_local = threading.local()
+
+        # LRU of preprocessed images keyed by content hash. Off by default (0) so that
+        # documents are not retained in memory across calls unless the caller opts in
+        self.preprocess_cache_size = preprocess_cache_size
+        self._prep_cache = OrderedDict()
+        self._prep_cache_lock = threading.Lock()
         
         if api_key is None or len(api_key) == 0:
             self.api_headers = None
         else:
             self.api_headers = {"Authorization": f"Bearer {api_key}"}
+
+        # Shared session so downloads and Ollama calls reuse keep-alive connections
+        retry_policy = Retry(total=3, connect=3, read=2, backoff_factor=0.3,
+                             status_forcelist=[429, 500, 502, 503, 504],
+                             respect_retry_after_header=False)
+        adapter = HTTPAdapter(max_retries=retry_policy,
+                              pool_connections=max(self.max_workers, 10),
+                              pool_maxsize=max(self.max_workers * 4, 32),
+                              pool_block=False)
+        self._session = requests.Session()
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+
+    def close(self):
+        """Close the pooled HTTP connections"""
+        self._session.close()
+
+    def __del__(self):
+        session = getattr(self, "_session", None)
+        if session is not None:
+            session.close()
      
     def _is_url(self, path: str) -> bool:
         """Check if the path is a URL"""
         return path.startswith('http://') or path.startswith('https://')   
     
-    def _download_file(self, url: str, timeout: int = 30) -> str:
-        """Download file from URL to temporary location"""
+    def _download_file(self, url: str, workdir: str = None, timeout: int = 30) -> str:
+        """Download file from URL to a temporary location (inside workdir if given)"""
         try:
-            response = requests.get(url, timeout=timeout)
-            response.raise_for_status()
-            
-            # Determine file extension
-            content_type = response.headers.get('Content-Type', '')
-            parsed_url = urllib.parse.urlparse(url)
-            path_ext = os.path.splitext(parsed_url.path)[1]
-            
-            # Get extension priority: Content-Type -> URL path -> default
-            if 'application/pdf' in content_type:
-                ext = '.pdf'
-            elif 'image/' in content_type:
-                ext = mimetypes.guess_extension(content_type) or path_ext or '.jpg'
-            else:
-                ext = path_ext or '.bin'
+            # Streamed responses hold a pooled connection until closed, so close it on every path
+            with self._session.get(url, timeout=timeout, stream=True) as response:
+                response.raise_for_status()
+
+                # Determine file extension
+                content_type = response.headers.get('Content-Type', '')
+                parsed_url = urllib.parse.urlparse(url)
+                path_ext = os.path.splitext(parsed_url.path)[1]
+
+                # Get extension priority: Content-Type -> URL path -> default
+                if 'application/pdf' in content_type:
+                    ext = '.pdf'
+                elif 'image/' in content_type:
+                    ext = mimetypes.guess_extension(content_type) or path_ext or '.jpg'
+                else:
+                    ext = path_ext or '.bin'
+
+                # Stream the body straight into a temp file with appropriate extension
+                with tempfile.NamedTemporaryFile(suffix=ext, delete=False, dir=workdir) as temp_file:
+                    response.raw.decode_content = True  # Undo gzip/deflate transfer encoding
+                    shutil.copyfileobj(response.raw, temp_file, 64 * 1024)
+                    return temp_file.name
 
-            # Create temp file with appropriate extension
-            with tempfile.NamedTemporaryFile(suffix=ext, delete=False) as temp_file:
-                temp_file.write(response.content)
-                return temp_file.name
-                
         except Exception as e:
             raise ValueError(f"Failed to download {url}: {str(e)}")
 
+    def _read_header(self, image_path: str):
+        """
+        Read (size, has_alpha) from the file header without decoding pixels.
+        Returns None if Pillow cannot read the file.
+        """
+        try:
+            with Image.open(image_path) as image:
+                has_alpha = image.mode in ("RGBA", "LA", "PA") or "transparency" in image.info
+                return image.size, has_alpha
+        except Exception:
+            return None
+
+    def _flatten_alpha(self, image: np.ndarray) -> np.ndarray:
+        """Composite a BGRA image onto white and reduce it to 8-bit BGR for JPEG encoding"""
+        scale = float(np.iinfo(image.dtype).max) if image.dtype.kind in "ui" else 1.0
+        pixels = image.astype(np.float32) / scale
+        alpha = pixels[:, :, 3:]
+        flattened = pixels[:, :, :3] * alpha + (1.0 - alpha)
+        return (flattened * 255.0 + 0.5).astype(np.uint8)
+
     def _encode_image(self, image_path: str) -> str:
-        """Convert image to base64 string"""
+        """Convert image to base64 string, downscaling it first if it exceeds max_image_side"""
         with open(image_path, "rb") as image_file:
-            return base64.b64encode(image_file.read()).decode("utf-8")
+            data = image_file.read()
+        header = self._read_header(image_path) if self.max_image_side else None
+        if header is not None and max(header[0]) > self.max_image_side:
+            has_alpha = header[1]
+            # IMREAD_COLOR would drop transparency, leaving whatever colour the hidden pixels hold
+            flags = cv2.IMREAD_UNCHANGED if has_alpha else cv2.IMREAD_COLOR
+            image = cv2.imdecode(np.frombuffer(data, np.uint8), flags)
+            if image is not None:
+                image = self._downscale(image)
+                # Keep PNG sources lossless (alpha included); everything else is re-encoded as JPEG
+                if image_path.lower().endswith(".png"):
+                    return self._encode_array(image, ".png")
+                if image.ndim == 3 and image.shape[2] == 4:
+                    image = self._flatten_alpha(image)
+                return self._encode_array(image, ".jpg")
+        return base64.b64encode(data).decode("ascii")
+
+    def _encode_array(self, image: np.ndarray, ext: str = ".jpg") -> str:
+        """Encode an image array in memory (JPEG by default) and convert it to base64 string"""
+        ok, buf = cv2.imencode(ext, image)
+        if not ok:
+            raise ValueError(f"Could not encode image as {ext}")
+        # b64encode reads the encoder's buffer through the buffer protocol, no tobytes() copy
+        encoded = base64.b64encode(memoryview(buf))
+        del buf
+        return encoded.decode("ascii")
+
+    def _throttle(self):
+        """Wait until the next Ollama call is allowed under requests_per_second"""
+        if not self.requests_per_second:
+            return
+        with self._rate_lock:
+            now = time.monotonic()
+            wait = self._next_request_at - now
+            self._next_request_at = max(now, self._next_request_at) + 1.0 / self.requests_per_second
+        if wait > 0:
+            time.sleep(wait)
+
+    def _generate(self, prompt: str, images: List[str]) -> str:
+        """Send a prompt and base64 images to Ollama and return the response text"""
+        payload = {
+            "model": self.model_name,
+            "prompt": prompt,
+            "stream": False,
+            "images": images
+        }
+        with self._request_sem:
+            self._throttle()
+            response = self._session.post(self.base_url, json=payload, headers=self.api_headers)
+        response.raise_for_status()
+        # Decode the raw body once, skipping requests' text decoding step
+        return json.loads(response.content).get("response", "")
+
+    def _split_batch_response(self, text: str, count: int) -> Union[List[str], None]:
+        """Split a multi-image response on its page delimiters; None if the model did not follow them"""
+        parts = _PAGE_DELIMITER_RE.split(text)
+        # parts = [preamble, "1", text1, "2", text2, ...]
+        if [int(n) for n in parts[1::2]] != list(range(1, count + 1)):
+            return None
+        return [part.strip() for part in parts[2::2]]
+
+    def _format_result(self, result: str, format_type: str) -> str:
+        """Pretty-print the result when JSON output was requested and the model produced valid JSON"""
+        if format_type != "json":
+            return result
+        # Only an object or array is worth parsing; multi-page PDF output ("Page 1:...") never is
+        if result.lstrip()[:1] not in ("{", "["):
+            return result
+        try:
+            return json.dumps(json.loads(result), indent=2)
+        except json.JSONDecodeError:
+            return result
 
-    def _pdf_to_images(self, pdf_path: str) -> List[str]:
+    def _render_pdf_page(self, doc, page_num: int, grayscale: bool = False) -> np.ndarray:
         """
-        Convert each page of a PDF to an image using pymupdf.
-        Saves each page as a temporary image.
-        Returns a list of image paths.
+        Render one page of an open PDF to an image using pymupdf.
+        Wraps the rendered pixmap as a numpy array without encoding it.
+        Returns an RGB array, or a single-channel array if grayscale is set.
         """
         try:
-            doc = pymupdf.open(pdf_path)
-            image_paths = []
-            for page_num in range(doc.page_count):
-                page = doc[page_num]
-                pix = page.get_pixmap()  # Render page to an image
-                temp_path = f"{pdf_path}_page{page_num}.png"  # Define output image path
-                pix.save(temp_path)  # Save the image
-                image_paths.append(temp_path)
-            doc.close()
-            return image_paths
+            colorspace = pymupdf.csGRAY if grayscale else pymupdf.csRGB
+            pix = doc[page_num].get_pixmap(colorspace=colorspace)  # Render page to an image
+            shape = (pix.height, pix.width) if pix.n == 1 else (pix.height, pix.width, pix.n)
+            return np.frombuffer(pix.samples, dtype=np.uint8).reshape(shape)
         except Exception as e:
-            raise ValueError(f"Could not convert PDF to images: {e}")
+            raise ValueError(f"Could not convert PDF page {page_num} to image: {e}")
 
-    def _preprocess_image(self, image_path: str, language: str = "en") -> str:
+    def _load_image(self, image_path: str, data: bytes) -> np.ndarray:
+        """Decode the bytes of an image file straight into a grayscale array"""
+        image = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_GRAYSCALE)
+        if image is None:
+            raise ValueError(f"Could not read image at {image_path}")
+        return image
+
+    def _preprocess_cached(self, data, load_image, language: str) -> str:
+        """
+        Preprocess and encode an image, reusing the result for identical input.
+        data is the raw content used as cache key; load_image() returns the array to preprocess.
+        """
+        if not self.preprocess_cache_size:
+            return self._encode_array(self._preprocess_image(load_image(), language))
+
+        key = (hashlib.blake2b(data, digest_size=16).digest(), getattr(data, "shape", None),
+               language, self.denoise_strength, self.max_image_side)
+        with self._prep_cache_lock:
+            cached = self._prep_cache.get(key)
+            if cached is not None:
+                self._prep_cache.move_to_end(key)
+                return cached
+
+        encoded = self._encode_array(self._preprocess_image(load_image(), language))
+
+        with self._prep_cache_lock:
+            self._prep_cache[key] = encoded
+            while len(self._prep_cache) > self.preprocess_cache_size:
+                self._prep_cache.popitem(last=False)
+        return encoded
+
+    def _get_clahe(self):
+        """Return this thread's CLAHE instance, creating it on first use"""
+        clahe = getattr(self._thread_local, "clahe", None)
+        if clahe is None:
+            clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8,8))
+            self._thread_local.clahe = clahe
+        return clahe
+
+    def _downscale(self, image: np.ndarray) -> np.ndarray:
+        """Shrink the image so its longest side is at most max_image_side"""
+        longest = max(image.shape[:2])
+        if not self.max_image_side or longest <= self.max_image_side:
+            return image
+        scale = self.max_image_side / longest
+        return cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+    def _preprocess_image(self, image: np.ndarray, language: str = "en") -> np.ndarray:
         """
         Preprocess image before OCR:
-        - Convert PDF to image if needed (using pymupdf)
+        - Downscale oversized images
         - Language-specific preprocessing (if applicable)
         - Enhance contrast
         - Reduce noise
+        Returns the preprocessed image array.
         """
-        # Read image
-        image = cv2.imread(image_path)
-        if image is None:
-            raise ValueError(f"Could not read image at {image_path}")
+        # Downscale first so the remaining steps work on fewer pixels
+        image = self._downscale(image)
 
         # Convert to grayscale
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        gray = image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
 
         # Enhance contrast using CLAHE
-        clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8,8))
-        enhanced = clahe.apply(gray)
+        enhanced = self._get_clahe().apply(gray)
 
         # Denoise
-        denoised = cv2.fastNlMeansDenoising(enhanced)
+        if self.denoise_strength == "high":
+            denoised = cv2.fastNlMeansDenoising(enhanced)
+        else:
+            denoised = cv2.bilateralFilter(enhanced, d=5, sigmaColor=35, sigmaSpace=35)
 
         # Language-specific thresholding
         if language.lower() in ["japanese", "chinese", "zh", "korean"]:
             # For some CJK and similar languages adaptive thresholding may work better
             thresh = cv2.adaptiveThreshold(
                 denoised, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, 
-                cv2.THRESH_BINARY, 11, 2)
-            thresh = cv2.bitwise_not(thresh)
+                cv2.THRESH_BINARY_INV, 11, 2)
         else:
-            # Default: Otsu thresholding
-            thresh = cv2.threshold(denoised, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)[1]
-            thresh = cv2.bitwise_not(thresh)
-
-        # Save preprocessed image
-        preprocessed_path = f"{image_path}_preprocessed.jpg"
-        cv2.imwrite(preprocessed_path, thresh)
+            # Default: Otsu thresholding (inverted in the same pass)
+            thresh = cv2.threshold(denoised, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)[1]
 
-        return preprocessed_path
+        return thresh
 
     def process_image(self, image_path: str, format_type: str = "markdown", preprocess: bool = True, 
-                      custom_prompt: str = None, language: str = "en") -> str:
+                      custom_prompt: str = None, language: str = "en", batch_size: int = 1) -> str:
         """
         Process an image (or PDF) and extract text in the specified format
 
@@ -136,15 +384,24 @@ class OCRProcessor:
             preprocess: Whether to apply image preprocessing
             custom_prompt: If provided, this prompt overrides the default based on format_type
             language: Language code to apply language specific OCR preprocessing
+            batch_size: Number of PDF pages sent to the model in a single request
         """
         
-        temp_files_to_cleanup = []
+        temp_dir = None
         
         try:
+            if custom_prompt and custom_prompt.strip():
+                prompt = custom_prompt
+                logger.debug("Using custom prompt: %s", prompt)
+            else:
+                prompt = _get_prompt(format_type, language)
+                logger.debug("Using default prompt: %s", prompt)
+
             if self._is_url(image_path):
-                local_path = self._download_file(image_path)
-                temp_files_to_cleanup.append(local_path)
-                print(f"Downloaded remote file to: {local_path}")
+                # Managed temp directory, removed as a whole once processing ends
+                temp_dir = tempfile.TemporaryDirectory(prefix="ollama_ocr_")
+                local_path = self._download_file(image_path, temp_dir.name)
+                logger.debug("Downloaded remote file to: %s", local_path)
             else:
                 local_path = image_path
              
@@ -153,200 +410,87 @@ class OCRProcessor:
                
             # If the input is a PDF, process all pages
             if local_path.lower().endswith('.pdf'):
-                image_pages = self._pdf_to_images(local_path)
-                temp_files_to_cleanup.extend(image_pages)
-                print("No. of pages in the PDF", len(image_pages))
-                responses = []
-                for idx, page_file in enumerate(image_pages):
+                try:
+                    doc = pymupdf.open(local_path)
+                except Exception as e:
+                    raise ValueError(f"Could not convert PDF to images: {e}")
+                page_count = doc.page_count
+                logger.debug("No. of pages in the PDF: %d", page_count)
+                # pymupdf documents are not thread-safe, so page workers render one at a time
+                doc_lock = threading.Lock()
+
+                def _encode_page(page_num: int) -> str:
+                    # Render pages lazily so only the pages in flight are held in memory;
+                    # preprocessing works on grayscale, so let pymupdf render 1-channel pages
+                    with doc_lock:
+                        page = self._render_pdf_page(doc, page_num, grayscale=preprocess)
                     # Process each page with preprocessing if enabled
                     if preprocess:
-                        preprocessed_path = self._preprocess_image(page_file, language)
-                        temp_files_to_cleanup.append(preprocessed_path)
-                    else:
-                        preprocessed_path = page_file
-
-                    image_base64 = self._encode_image(preprocessed_path)
-
-                    if custom_prompt and custom_prompt.strip():
-                        prompt = custom_prompt
-                        print("Using custom prompt:", prompt)  # Debug print
-                    else:
-                        prompts = {
-                            "markdown": f"""Extract all text content from this image in {language} **exactly as it appears**, without modification, summarization, or omission.
-                                Format the output in markdown:
-                                - Use headers (#, ##, ###) **only if they appear in the image**
-                                - Preserve original lists (-, *, numbered lists) as they are
-                                - Maintain all text formatting (bold, italics, underlines) exactly as seen
-                                - **Do not add, interpret, or restructure any content**
-                            """,
-                            "text": f"""Extract all visible text from this image in {language} **without any changes**.
-                                - **Do not summarize, paraphrase, or infer missing text.**
-                                - Retain all spacing, punctuation, and formatting exactly as in the image.
-                                - If text is unclear or partially visible, extract as much as possible without guessing.
-                                - **Include all text, even if it seems irrelevant or repeated.** 
-                                """,
-
-
-                           "json": f"""Extract all text from this image in {language} and format it as JSON, **strictly preserving** the structure.
-                                - **Do not summarize, add, or modify any text.**
-                                - Maintain hierarchical sections and subsections as they appear.
-                                - Use keys that reflect the document's actual structure (e.g., "title", "body", "footer").
-                                - Include all text, even if fragmented, blurry, or unclear.
-                                """,
-
-
-                            "structured": f"""Extract all text from this image in {language}, **ensuring complete structural accuracy**:
-                                - Identify and format tables **without altering content**.
-                                - Preserve list structures (bulleted, numbered) **exactly as shown**.
-                                - Maintain all section headings, indents, and alignments.
-                                - **Do not add, infer, or restructure the content in any way.**
-                                """,
-
-
-                           "key_value": f"""Extract all key-value pairs from this image in {language} **exactly as they appear**:
-                                - Identify and extract labels and their corresponding values without modification.
-                                - Maintain the exact wording, punctuation, and order.
-                                - Format each pair as 'key: value' **only if clearly structured that way in the image**.
-                                - **Do not infer missing values or add any extra text.**
-                                """,
-
-                            "table": f"""Extract all tabular data from this image in {language} **exactly as it appears**, without modification, summarization, or omission.
-                                - **Preserve the table structure** (rows, columns, headers) as closely as possible.
-                                - **Do not add missing values or infer content**—if a cell is empty, leave it empty.
-                                - Maintain all numerical, textual, and special character formatting.
-                                - If the table contains merged cells, indicate them clearly without altering their meaning.
-                                - Output the table in a structured format such as Markdown, CSV, or JSON, based on the intended use.
-                                """,
-
-
-                        }
-                        prompt = prompts.get(format_type, prompts["text"])
-                        print("Using default prompt:", prompt)  # Debug print
-
-                    # Prepare the request payload
-                    payload = {
-                        "model": self.model_name,
-                        "prompt": prompt,
-                        "stream": False,
-                        "images": [image_base64]
-                    }
-
-                    # Make the API call to Ollama
-                    response = requests.post(self.base_url, json=payload, headers=self.api_headers)
-                    response.raise_for_status()
-                    res = response.json().get("response", "")
-                    print("Page No. Processed", idx)
-                    # Prefix result with page number
-                    responses.append(f"Page {idx + 1}:\n{res}")
-
-                    # Clean up temporary files
-                    if preprocess and preprocessed_path.endswith('_preprocessed.jpg'):
-                        os.remove(preprocessed_path)
-                    if page_file.endswith('.png'):
-                        os.remove(page_file)
+                        return self._preprocess_cached(page, lambda: page, language)
+                    return self._encode_array(cv2.cvtColor(self._downscale(page), cv2.COLOR_RGB2BGR), ".png")
+
+                def _process_pages(start: int) -> List[str]:
+                    end = min(start + batch_size, page_count)
+                    images = [_encode_page(page_num) for page_num in range(start, end)]
+
+                    # Make the API call to Ollama, several pages at once when batching
+                    texts = None
+                    if len(images) > 1:
+                        batch_prompt = prompt + _BATCH_PROMPT_SUFFIX.format(count=len(images))
+                        texts = self._split_batch_response(self._generate(batch_prompt, images), len(images))
+                    if texts is None:
+                        # Single-page mode, or the model did not keep the page delimiters
+                        texts = [self._generate(prompt, [image]) for image in images]
+                    logger.debug("Pages processed: %d-%d", start, start + len(images) - 1)
+                    # Prefix results with page number
+                    return [f"Page {start + i + 1}:\n{res}" for i, res in enumerate(texts)]
+
+                # Page groups are independent, so send them to Ollama concurrently;
+                # map() keeps the results in page order
+                batch_size = max(1, batch_size)
+                starts = range(0, page_count, batch_size)
+                page_workers = max(1, min(self.max_workers, len(starts)))
+                with doc, concurrent.futures.ThreadPoolExecutor(max_workers=page_workers) as executor:
+                    responses = [res for group in executor.map(_process_pages, starts) for res in group]
 
                 final_result = "\n".join(responses)
-                if format_type == "json":
-                    try:
-                        json_data = json.loads(final_result)
-                        return json.dumps(json_data, indent=2)
-                    except json.JSONDecodeError:
-                        return final_result
-                return final_result
+                return self._format_result(final_result, format_type)
 
             # Process non-PDF images as before.
             if preprocess:
-                preprocessed_path = self._preprocess_image(local_path, language)
-                temp_files_to_cleanup.append(preprocessed_path)
-                image_path_to_process = preprocessed_path
-            else:
-                image_path_to_process = local_path
-
-            image_base64 = self._encode_image(image_path_to_process)
-
-            if custom_prompt and custom_prompt.strip():
-                prompt = custom_prompt
-                print("Using custom prompt:", prompt)
+                with open(local_path, "rb") as image_file:
+                    data = image_file.read()
+                image_base64 = self._preprocess_cached(
+                    data, lambda: self._load_image(local_path, data), language)
             else:
-                prompts = {
-                            "markdown": f"""Extract all text content from this image in {language} **exactly as it appears**, without modification, summarization, or omission.
-                                Format the output in markdown:
-                                - Use headers (#, ##, ###) **only if they appear in the image**
-                                - Preserve original lists (-, *, numbered lists) as they are
-                                - Maintain all text formatting (bold, italics, underlines) exactly as seen
-                                - **Do not add, interpret, or restructure any content**
-                            """,
-                            "text": f"""Extract all visible text from this image in {language} **without any changes**.
-                                - **Do not summarize, paraphrase, or infer missing text.**
-                                - Retain all spacing, punctuation, and formatting exactly as in the image.
-                                - If text is unclear or partially visible, extract as much as possible without guessing.
-                                - **Include all text, even if it seems irrelevant or repeated.** 
-                                """,
-
+                image_base64 = self._encode_image(local_path)
 
-                           "json": f"""Extract all text from this image in {language} and format it as JSON, **strictly preserving** the structure.
-                                - **Do not summarize, add, or modify any text.**
-                                - Maintain hierarchical sections and subsections as they appear.
-                                - Use keys that reflect the document's actual structure (e.g., "title", "body", "footer").
-                                - Include all text, even if fragmented, blurry, or unclear.
-                                """,
-
-
-                            "structured": f"""Extract all text from this image in {language}, **ensuring complete structural accuracy**:
-                                - Identify and format tables **without altering content**.
-                                - Preserve list structures (bulleted, numbered) **exactly as shown**.
-                                - Maintain all section headings, indents, and alignments.
-                                - **Do not add, infer, or restructure the content in any way.**
-                                """,
-
-
-                           "key_value": f"""Extract all key-value pairs from this image in {language} **exactly as they appear**:
-                                - Identify and extract labels and their corresponding values without modification.
-                                - Maintain the exact wording, punctuation, and order.
-                                - Format each pair as 'key: value' **only if clearly structured that way in the image**.
-                                - **Do not infer missing values or add any extra text.**
-                                """,
-
-                            "table": f"""Extract all tabular data from this image in {language} **exactly as it appears**, without modification, summarization, or omission.
-                                - **Preserve the table structure** (rows, columns, headers) as closely as possible.
-                                - **Do not add missing values or infer content**—if a cell is empty, leave it empty.
-                                - Maintain all numerical, textual, and special character formatting.
-                                - If the table contains merged cells, indicate them clearly without altering their meaning.
-                                - Output the table in a structured format such as Markdown, CSV, or JSON, based on the intended use.
-                                """,
-                }
-                prompt = prompts.get(format_type, prompts["text"])
-                print("Using default prompt:", prompt)  # Debug print
-
-            payload = {
-                "model": self.model_name,
-                "prompt": prompt,
-                "stream": False,
-                "images": [image_base64]
-            }
-
-            response = requests.post(self.base_url, json=payload, headers=self.api_headers)
-            response.raise_for_status()
-
-            result = response.json().get("response", "")
-
-            if format_type == "json":
-                try:
-                    json_data = json.loads(result)
-                    return json.dumps(json_data, indent=2)
-                except json.JSONDecodeError:
-                    return result
-
-            return result
+            result = self._generate(prompt, [image_base64])
+            return self._format_result(result, format_type)
         except Exception as e:
             return f"Error processing image: {str(e)}"
         finally:
-            for file_path in temp_files_to_cleanup:
+            if temp_dir is not None:
                 try:
-                    if os.path.exists(file_path):
-                        os.remove(file_path)
+                    temp_dir.cleanup()
                 except Exception as e:
-                    print(f"Error cleaning up temporary file {file_path}: {e}")
+                    logger.warning("Error cleaning up temporary directory %s: %s", temp_dir.name, e)
+
+    def _collect_paths(self, path: str, recursive: bool = False) -> List[str]:
+        """Expand a URL, file or directory into the list of inputs to process"""
+        if self._is_url(path):
+            return [path]
+        base_path = Path(path)
+        if base_path.is_dir():
+            # Single walk of the directory, filtering by extension
+            entries = base_path.rglob('*') if recursive else base_path.iterdir()
+            return [
+                str(p) for p in entries
+                if p.suffix in _BATCH_EXTENSIONS and p.is_file()
+            ]
+        if base_path.exists():
+            return [str(base_path)]
+        return []
 
     def process_batch(
         self,
@@ -372,36 +516,11 @@ class OCRProcessor:
             Dictionary with results and statistics
         """
         # Collect all image paths
-        image_paths = []
         if isinstance(input_path, str):
-            if self._is_url(input_path):
-                image_paths.append(input_path)
-            else:
-                base_path = Path(input_path)
-                if base_path.is_dir():
-                    pattern = '**/*' if recursive else '*'
-                    for ext in ['.png', '.jpg', '.jpeg', '.pdf', '.tiff']:
-                        image_paths.extend([
-                            str(p) for p in base_path.glob(f'{pattern}{ext}') 
-                            if p.is_file()
-                        ])
-                elif base_path.exists():
-                    image_paths.append(str(base_path))
-        else:
-            for path in input_path:
-                if self._is_url(path):
-                    image_paths.append(path)
-                else:
-                    base_path = Path(path)
-                    if base_path.is_dir():
-                        pattern = '**/*' if recursive else '*'
-                        for ext in ['.png', '.jpg', '.jpeg', '.pdf', '.tiff']:
-                            image_paths.extend([
-                                str(p) for p in base_path.glob(f'{pattern}{ext}') 
-                                if p.is_file()
-                            ])
-                    elif base_path.exists():
-                        image_paths.append(str(base_path))    
+            input_path = [input_path]
+        image_paths = []
+        for path in input_path:
+            image_paths.extend(self._collect_paths(path, recursive))
 
         results = {}
         errors = {}